@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Copyright (C) 2018 - Playspace
+"""
+Memory and throughput of ConfigBunch against the Bunch(lower_keys(load_json(...))) idiom
+on a large synthetic manifest.
+
+    $ python benchmarks/bench_config.py [entries]
+"""
+import os
+import sys
+import tempfile
+import timeit
+import tracemalloc
+
+from pspylib.common import Bunch, ConfigBunch, lower_keys, load_json, write_json
+
+
+def make_manifest(entries):
+    return {
+        'Name': 'Manifest',
+        'Platforms': [{'Name': 'platform{}'.format(i), 'BundleVersion': '1.0.{}'.format(i),
+                       'Assets': dict(('Asset{}'.format(j), j) for j in range(20))} for i in range(entries)],
+    }
+
+
+def measure(build, lookup, rounds=5):
+    # Memory held right after loading and once a lookup pass created whatever the lookups keep around
+    tracemalloc.start()
+    config = build()
+    _, peak = tracemalloc.get_traced_memory()
+    lookup(config)
+    after_lookup, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del config
+
+    config = build()
+    build_time = min(timeit.repeat(build, number=1, repeat=rounds))
+    # First pass creates the ConfigBunch wrappers, the next ones hit the cached values
+    first_lookup_time = timeit.timeit(lambda: lookup(config), number=1)
+    lookup_time = min(timeit.repeat(lambda: lookup(config), number=1, repeat=rounds))
+    return build_time, peak, after_lookup, first_lookup_time, lookup_time
+
+
+def main(entries=5000):
+    with tempfile.TemporaryDirectory() as tmpdir:
+        json_path = os.path.join(tmpdir, 'manifest.json')
+        write_json(make_manifest(entries), json_path)
+
+        def bunch_lookup(config):
+            for platform in config.platforms:
+                platform['bundleversion']
+                platform['assets']['asset10']
+
+        def config_bunch_lookup(config):
+            for platform in config.Platforms:
+                platform.BundleVersion
+                platform.assets.ASSET10
+
+        results = [
+            ('Bunch(lower_keys(load_json))', measure(lambda: Bunch(lower_keys(load_json(json_path))), bunch_lookup)),
+            ('ConfigBunch(load_json)', measure(lambda: ConfigBunch(load_json(json_path)), config_bunch_lookup)),
+        ]
+
+    print('{:<32}{:>12}{:>14}{:>16}{:>12}{:>12}'.format('', 'build (s)', 'peak (MB)', 'looked up (MB)',
+                                                        'first (s)', 'lookup (s)'))
+    for name, (build_time, peak, after_lookup, first_lookup_time, lookup_time) in results:
+        print('{:<32}{:>12.4f}{:>14.2f}{:>16.2f}{:>12.4f}{:>12.4f}'.format(
+            name, build_time, peak / (1024 * 1024.0), after_lookup / (1024 * 1024.0), first_lookup_time, lookup_time))
+
+
+if __name__ == "__main__":
+    sys.exit(main(*[int(arg) for arg in sys.argv[1:]]))
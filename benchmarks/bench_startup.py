@@ -0,0 +1,58 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Copyright (C) 2018 - Playspace
+"""
+Cold start costs measured in fresh interpreters: import time of the modules our CLIs pull in
+and the package metadata lookup done by PackageInfo.
+
+    $ python benchmarks/bench_startup.py [package]
+"""
+import subprocess
+import sys
+
+
+def run_python(code, *options):
+    return subprocess.run([sys.executable, '-W', 'ignore'] + list(options) + ['-c', code],
+                          stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True, check=True)
+
+
+def cold_import_us(module, rounds=5):
+    """ Best cumulative import time, in microseconds, of module in a fresh interpreter according to -X importtime
+    """
+    best = None
+    for _ in range(rounds):
+        stderr = run_python('import {}'.format(module), '-X', 'importtime').stderr
+        for line in stderr.splitlines():
+            fields = line.split('|')
+            if len(fields) == 3 and fields[2].strip() == module:
+                cumulative = int(fields[1])
+                best = cumulative if best is None else min(best, cumulative)
+    return best
+
+
+def cold_call_ms(setup, statement, rounds=5):
+    """ Best time, in milliseconds, to run statement in a fresh interpreter once setup is done
+    """
+    code = '{}\nimport time\nt = time.perf_counter()\n{}\nprint((time.perf_counter() - t) * 1000)'.format(setup, statement)
+    return min(float(run_python(code).stdout) for _ in range(rounds))
+
+
+def main(package='pspylib'):
+    print('{:<48}{:>12}'.format('cold import', 'ms'))
+    for module in ['pkg_resources', 'importlib.metadata', 'pspylib.common', 'pspylib.tools']:
+        print('{:<48}{:>12.1f}'.format(module, cold_import_us(module) / 1000.0))
+
+    print('{:<48}{:>12}'.format('first metadata lookup', 'ms'))
+    try:
+        print('{:<48}{:>12.1f}'.format('pkg_resources.get_distribution (with import)', cold_call_ms(
+            '', 'import pkg_resources; pkg_resources.get_distribution({!r}).version'.format(package))))
+        print('{:<48}{:>12.1f}'.format('PackageInfo', cold_call_ms(
+            'from pspylib.common import PackageInfo', 'PackageInfo({!r}).version'.format(package))))
+    except subprocess.CalledProcessError as e:
+        print('Skipped, could not read the metadata of {!r}: {}'.format(package, e.stderr.strip().splitlines()[-1]))
+        if package == 'pspylib':
+            print('Install it with "pip install -e ." from the repository root')
+
+
+if __name__ == "__main__":
+    sys.exit(main(*sys.argv[1:]))
@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Copyright (C) 2018 - Playspace
+"""
+Startup regression check: fails when a cold 'import pspylib.tools' is slower than the budget,
+when importing it or running a no-op tool through main_tool loads any of the heavy dependencies
+that must only be loaded on first use, or when 'from pspylib.tools import *' stops exporting the
+names tools rely on.
+
+    $ python benchmarks/check_import_budget.py [budget_ms]
+"""
+import os
+import sys
+import tempfile
+
+from bench_startup import cold_import_us, run_python
+
+DEFAULT_BUDGET_MS = 150
+LAZY_MODULES = ['git', 'psutil', 'colorama', 'argcomplete', 'pkg_resources', 'distutils', 'readline']
+EXPORTED_NAMES = ['Repo', 'Head', 'psutil', 'Fore', 'Style', 'init', 'StrictVersion', 'pkg_resources',
+                  'message_from_string', 'inspect', 'argcomplete', 'tempfile', 'subprocess']
+
+NOOP_TOOL = '''from pspylib.tools import *
+
+
+@register_tool(name="noop")
+class NoopTool(ITool):
+    def __init__(self, parser, tmpdir):
+        pass
+
+    def execute(self, args, tmpdir):
+        return EXIT_CODE_SUCCESS
+'''
+
+
+def lazy_modules_after_main_tool():
+    """ Heavy dependencies loaded by running a tool that does nothing, which is what every CLI call pays
+    """
+    with tempfile.TemporaryDirectory() as workdir:
+        root = os.path.join(workdir, 'budgettools')
+        os.makedirs(os.path.join(root, 'noop'))
+        for path, text in [('__init__.py', ''), (os.path.join('noop', '__init__.py'), ''),
+                           (os.path.join('noop', 'tool.py'), NOOP_TOOL)]:
+            with open(os.path.join(root, path), 'w') as f:
+                f.write(text)
+        return run_python('\n'.join([
+            'import sys',
+            'sys.path.insert(0, {!r})',
+            'from pspylib.tools import main_tool',
+            'main_tool({!r}, ["noop"], server=False)',
+            'print(" ".join(m for m in {!r} if m in sys.modules))',
+        ]).format(workdir, root, LAZY_MODULES)).stdout.split()
+
+
+def main(budget_ms=DEFAULT_BUDGET_MS):
+    failed = False
+
+    output = run_python('\n'.join([
+        'import sys',
+        'from pspylib.tools import *',
+        'print(" ".join(m for m in {!r} if m in sys.modules))',
+        'print(" ".join(n for n in {!r} if n not in globals()))',
+    ]).format(LAZY_MODULES, EXPORTED_NAMES)).stdout.split('\n')
+    loaded, missing = output[0].split(), output[1].split()
+    if loaded:
+        print('Eagerly imported by pspylib.tools: {}'.format(', '.join(loaded)))
+        failed = True
+    if missing:
+        print('Not exported by pspylib.tools anymore: {}'.format(', '.join(missing)))
+        failed = True
+
+    loaded = lazy_modules_after_main_tool()
+    if loaded:
+        print('Imported by a no-op main_tool run: {}'.format(', '.join(loaded)))
+        failed = True
+
+    import_ms = cold_import_us('pspylib.tools') / 1000.0
+    print('Cold import of pspylib.tools: {:.1f} ms (budget {} ms)'.format(import_ms, budget_ms))
+    if import_ms > budget_ms:
+        failed = True
+
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(*[float(arg) for arg in sys.argv[1:]]))
@@ -0,0 +1,317 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Copyright (C) 2018 - Playspace
+"""
+Offline benchmark suite of the pspylib hot paths. Results can be stored as json and compared against
+a previous run to catch regressions.
+
+    $ python benchmarks/run_benchmarks.py --output before.json
+    $ python benchmarks/run_benchmarks.py --compare before.json --threshold 0.2 -k 'git_*'
+"""
+import argparse
+import datetime
+import fnmatch
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from pspylib.common import *
+from pspylib.tools import find_tools
+
+registered_benchmarks = {}
+
+
+def register_benchmark(name=None, repeat=5, number=1):
+    """
+    Makes a function part of the suite. The function gets a scratch dir to prepare its data and returns
+    the callable to time, or a (callable, reset) tuple when every repetition needs fresh data
+    """
+
+    def dec(function):
+        registered_benchmarks[name or function.__name__] = {'function': function, 'repeat': repeat, 'number': number}
+        return function
+
+    return dec
+
+
+def run_benchmark(benchmark, workdir):
+    # Benchmarks may put their scratch dir on sys.path and import from it, none of it outlives the run
+    saved_path = list(sys.path)
+    saved_modules = set(sys.modules)
+    try:
+        prepared = benchmark['function'](workdir)
+        run, reset = prepared if isinstance(prepared, tuple) else (prepared, None)
+        timings = []
+        for _ in range(benchmark['repeat']):
+            if reset:
+                reset()
+            start = time.perf_counter()
+            for _ in range(benchmark['number']):
+                run()
+            timings.append((time.perf_counter() - start) / benchmark['number'])
+    finally:
+        sys.path[:] = saved_path
+        for module_name in set(sys.modules) - saved_modules:
+            if (getattr(sys.modules[module_name], '__file__', None) or '').startswith(workdir):
+                del sys.modules[module_name]
+    return {
+        'min': min(timings),
+        'median': statistics.median(timings),
+        'mean': statistics.mean(timings),
+        'stdev': statistics.stdev(timings) if len(timings) > 1 else 0.0,
+        'repeat': benchmark['repeat'],
+        'number': benchmark['number'],
+    }
+
+
+def git(*args, cwd=None):
+    subprocess.run(['git', '-c', 'user.name=bench', '-c', 'user.email=bench@playspace.com'] + list(args), cwd=cwd,
+                   check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+def make_git_origin(path, branches=50, tags=200):
+    """ Local bare repository with some history, branches and tags
+    """
+    work_path = path + '.work'
+    git('init', '-q', work_path)
+    for i in range(10):
+        write_to_file('{}\n'.format(i), os.path.join(work_path, 'file{}.txt'.format(i)))
+        git('add', '.', cwd=work_path)
+        git('commit', '-q', '-m', 'commit {}'.format(i), cwd=work_path)
+    for i in range(branches):
+        git('branch', 'feature/{}'.format(i), cwd=work_path)
+    for i in range(tags):
+        git('tag', 'build.game.release.android.1.0.{}'.format(i), cwd=work_path)
+    git('clone', '-q', '--bare', work_path, path)
+    purge_dir(work_path)
+    return path
+
+
+def make_tools_root(path, packages=10, modules=20):
+    """ Tools package like the ones main_tool loads, one tool per package and plain modules around them
+    """
+    ensure_dir(path)
+    write_to_file('', os.path.join(path, '__init__.py'))
+    for p in range(packages):
+        package_path = os.path.join(path, 'package{}'.format(p))
+        ensure_dir(package_path)
+        write_to_file('', os.path.join(package_path, '__init__.py'))
+        for m in range(modules):
+            write_to_file('VALUE = {}\n'.format(m) * 50, os.path.join(package_path, 'module{}.py'.format(m)))
+        write_to_file('\n'.join([
+            'from pspylib.tools import *',
+            '',
+            '@register_tool(name="tool{0}")',
+            'class Tool{0}(ITool):',
+            '    def __init__(self, parser, tmpdir):',
+            '        pass',
+            '',
+            '    def execute(self, args, tmpdir):',
+            '        return EXIT_CODE_SUCCESS',
+            '']).format(p), os.path.join(package_path, 'tool.py'))
+    return path
+
+
+def make_manifest(entries):
+    return {
+        'name': 'manifest',
+        'platforms': [{'name': 'platform{}'.format(i), 'bundle_version': '1.0.{}'.format(i),
+                       'assets': dict(('asset{}'.format(j), 'hash{}'.format(j)) for j in range(20))}
+                      for i in range(entries)],
+    }
+
+
+# ----------------------------------------------------------------------------------------
+# Tools
+# ----------------------------------------------------------------------------------------
+
+@register_benchmark()
+def find_tools_scan(workdir):
+    root = make_tools_root(os.path.join(workdir, 'benchtools'))
+    sys.path.insert(0, workdir)
+    # Modules are imported on the first call, this measures the scan of the next ones
+    find_tools(root)
+    return lambda: find_tools(root)
+
+
+@register_benchmark(repeat=5)
+def main_tool_startup(workdir):
+    root = make_tools_root(os.path.join(workdir, 'benchtools'))
+    code = 'import sys\nfrom pspylib.tools import main_tool\nsys.exit(main_tool({!r}, ["tool0"]))'.format(root)
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join([workdir] + sys.path))
+    env.pop('PSTOOL_SERVER', None)
+    return lambda: subprocess.run([sys.executable, '-W', 'ignore', '-c', code], env=env, check=True,
+                                  stdout=subprocess.DEVNULL)
+
+
+# ----------------------------------------------------------------------------------------
+# Commands
+# ----------------------------------------------------------------------------------------
+
+@register_benchmark(number=10)
+def execute_cmd_spawn(workdir):
+    return lambda: execute_cmd('exit 0', silent=True)
+
+
+@register_benchmark()
+def execute_cmd_capture_64mb(workdir):
+    command = [sys.executable, '-c', 'import sys; sys.stdout.write(("x" * 1023 + "\\n") * 65536)']
+    return lambda: execute_cmd(command, capture_output=True, silent=True)
+
+
+# ----------------------------------------------------------------------------------------
+# Git
+# ----------------------------------------------------------------------------------------
+
+@register_benchmark()
+def gather_repos_tree(workdir):
+    root = os.path.join(workdir, 'workspace')
+    for i in range(20):
+        repo_path = os.path.join(root, 'group{}'.format(i % 4), 'repo{}'.format(i))
+        git('init', '-q', repo_path)
+        for d in range(20):
+            ensure_dir(os.path.join(repo_path, 'src', 'dir{}'.format(d)))
+    ensure_dir(os.path.join(root, 'web', 'node_modules', 'dep', 'lib'))
+    return lambda: gather_repos(root)
+
+
+@register_benchmark(number=5)
+def git_ref_helpers(workdir):
+    from git import Repo
+    origin = make_git_origin(os.path.join(workdir, 'origin.git'))
+    repo = Repo.clone_from(origin, os.path.join(workdir, 'clone'))
+
+    def run():
+        git_has_remote_branch(repo, 'feature/25')
+        git_has_local_branch(repo, 'master')
+        git_has_remote_tags(repo, 'build.game.release.android.1.0.150')
+        git_has_local_tag(repo, 'build.game.release.android.1.0.150')
+        git_list_tags(repo)
+
+    return run
+
+
+# ----------------------------------------------------------------------------------------
+# Sorting
+# ----------------------------------------------------------------------------------------
+
+@register_benchmark()
+def sort_human_50k(workdir):
+    rng = random.Random(0)
+    names = ['build.{}.v{}-rc{}'.format(rng.choice(['ios', 'android']), rng.randint(0, 999), rng.randint(0, 9))
+             for _ in range(50000)]
+    return lambda: sort_human(list(names))
+
+
+@register_benchmark()
+def sort_versions_50k(workdir):
+    rng = random.Random(0)
+    versions = ['{}.{}.{}'.format(rng.randint(0, 20), rng.randint(0, 50), rng.randint(0, 500)) for _ in range(50000)]
+    return lambda: sort_versions(versions)
+
+
+# ----------------------------------------------------------------------------------------
+# I/O
+# ----------------------------------------------------------------------------------------
+
+@register_benchmark()
+def purge_dir_5k_files(workdir):
+    root = os.path.join(workdir, 'purge')
+
+    def reset():
+        for d in range(50):
+            dir_path = os.path.join(root, 'dir{}'.format(d))
+            ensure_dir(dir_path)
+            for f in range(100):
+                write_to_file('data', os.path.join(dir_path, 'file{}.txt'.format(f)))
+
+    return lambda: purge_dir(root), reset
+
+
+@register_benchmark()
+def copy_file_64mb(workdir):
+    src = os.path.join(workdir, 'src.bin')
+    with open(src, 'wb') as f:
+        f.write(os.urandom(64 * 1024 * 1024))
+    return lambda: copy_file(src, os.path.join(workdir, 'dst.bin'))
+
+
+@register_benchmark()
+def load_json_manifest(workdir):
+    json_path = os.path.join(workdir, 'manifest.json')
+    write_json(make_manifest(20000), json_path)
+    return lambda: load_json(json_path)
+
+
+@register_benchmark()
+def write_json_manifest(workdir):
+    manifest = make_manifest(20000)
+    return lambda: write_json(manifest, os.path.join(workdir, 'manifest.json'), pretty=True)
+
+
+# ----------------------------------------------------------------------------------------
+# Runner
+# ----------------------------------------------------------------------------------------
+
+def get_metadata():
+    revision = subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=os.path.dirname(os.path.abspath(__file__)),
+                              stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, universal_newlines=True)
+    return {
+        'date': datetime.datetime.now().isoformat(),
+        'revision': revision.stdout.strip() or None,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+    }
+
+
+def compare_results(baseline, results, threshold):
+    """ Prints both runs side by side and returns the names of the benchmarks whose median got slower than threshold
+    """
+    regressions = []
+    log_info("{:<28}{:>12}{:>12}{:>10}", 'benchmark', 'base (ms)', 'new (ms)', 'ratio')
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        ratio = result['median'] / baseline[name]['median'] if baseline[name]['median'] else 1.0
+        if ratio > 1.0 + threshold:
+            regressions.append(name)
+        log_info("{:<28}{:>12.2f}{:>12.2f}{:>10.2f}{}", name, baseline[name]['median'] * 1000,
+                 result['median'] * 1000, ratio, '  <-- slower' if name in regressions else '')
+    return regressions
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description='pspylib benchmark suite')
+    parser.add_argument('-k', dest='patterns', action='append', default=[],
+                        help='Only run benchmarks matching this glob, can be repeated')
+    parser.add_argument('--output', help='Store the results in this json file')
+    parser.add_argument('--compare', action=readable_file, help='Results json to compare against')
+    parser.add_argument('--threshold', type=float, default=0.1,
+                        help='Relative slowdown of the median reported as a regression')
+    args = parser.parse_args(argv)
+
+    names = [name for name in registered_benchmarks
+             if not args.patterns or any(fnmatch.fnmatch(name, pattern) for pattern in args.patterns)]
+    results = {}
+    for name in names:
+        with tempfile.TemporaryDirectory() as workdir:
+            results[name] = run_benchmark(registered_benchmarks[name], workdir)
+        log_info("{:<28}{:>10.2f} ms (+-{:.2f})", name, results[name]['median'] * 1000, results[name]['stdev'] * 1000)
+
+    if args.output:
+        write_json({'metadata': get_metadata(), 'results': results}, args.output, pretty=True)
+
+    if args.compare:
+        if compare_results(load_json(args.compare)['results'], results, args.threshold):
+            return EXIT_CODE_FAILED
+    return EXIT_CODE_SUCCESS
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
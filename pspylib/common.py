@@ -3,7 +3,6 @@
 # Copyright (C) 2018 - Playspace
 import os
 import re
-import psutil
 import sys
 import argparse
 import shutil
@@ -13,22 +12,104 @@ import time
 import subprocess
 import uuid
 import mmap
+import fnmatch
+import hashlib
 from shlex import quote
-from distutils.version import StrictVersion
-from git import Repo, Head
-import pkg_resources
+from contextlib import contextmanager
 from email import message_from_string
-from colorama import init, Fore, Style
-init()
-
-try:
-    import readline
-except:
-    pass  # readline not available
+import importlib
 
 EXIT_CODE_SUCCESS = 0
 EXIT_CODE_FAILED = 1
 
+# ----------------------------------------------------------------------------------------
+# Lazy imports
+# ----------------------------------------------------------------------------------------
+
+class _LazyImport(object):
+    """ Stands in for a module, or one of its attributes, that is only imported on first use.
+    Calls, attribute access, isinstance checks and subclassing are forwarded to the real object
+    e.g.   Repo = _LazyImport('git', 'Repo')
+    """
+    __slots__ = ('_module_name', '_attribute', '_target')
+
+    def __init__(self, module_name, attribute=None):
+        object.__setattr__(self, '_module_name', module_name)
+        object.__setattr__(self, '_attribute', attribute)
+        object.__setattr__(self, '_target', None)
+
+    def _resolve(self):
+        target = self._target
+        if target is None:
+            if self._module_name == 'colorama':
+                _init_colors()
+            target = importlib.import_module(self._module_name)
+            if self._attribute:
+                target = getattr(target, self._attribute)
+            object.__setattr__(self, '_target', target)
+        return target
+
+    def __getattr__(self, name):
+        return getattr(self._resolve(), name)
+
+    def __setattr__(self, name, value):
+        setattr(self._resolve(), name, value)
+
+    def __call__(self, *args, **kwargs):
+        return self._resolve()(*args, **kwargs)
+
+    def __instancecheck__(self, instance):
+        return isinstance(instance, self._resolve())
+
+    def __subclasscheck__(self, subclass):
+        return issubclass(subclass, self._resolve())
+
+    def __mro_entries__(self, bases):
+        return (self._resolve(),)
+
+    def __dir__(self):
+        return dir(self._resolve())
+
+    def __repr__(self):
+        return repr(self._resolve())
+
+
+# Heavy dependencies are only imported on first use so every tool doesn't pay for them at
+# startup. The names stay module globals, so 'from pspylib.common import *' keeps exporting them.
+psutil = _LazyImport('psutil')
+pkg_resources = _LazyImport('pkg_resources')
+StrictVersion = _LazyImport('distutils.version', 'StrictVersion')
+Repo = _LazyImport('git', 'Repo')
+Head = _LazyImport('git', 'Head')
+init = _LazyImport('colorama', 'init')
+Fore = _LazyImport('colorama', 'Fore')
+Style = _LazyImport('colorama', 'Style')
+
+
+_colors = None
+
+
+def _init_colors():
+    global _colors
+    if _colors is None:
+        from colorama import init, Fore, Style
+        init()
+        _colors = Fore, Style
+    return _colors
+
+
+_readline_loaded = False
+
+
+def _init_readline():
+    global _readline_loaded
+    if not _readline_loaded:
+        _readline_loaded = True
+        try:
+            import readline
+        except:
+            pass  # readline not available
+
 # ----------------------------------------------------------------------------------------
 # Profiling
 # ----------------------------------------------------------------------------------------
@@ -61,6 +142,7 @@ def sort_human(l, reverse=False):
 
 
 def sort_versions(l, reverse=False):
+    from distutils.version import StrictVersion
     return sorted(l, key=StrictVersion, reverse=reverse)
 
 
@@ -85,20 +167,24 @@ def xstr(s):
 
 
 def print_safe(text):
+    _init_colors()
     print(text)
 
 def log_info(text, *args, **kwargs):
     print_safe(xstr(text).format(*args, **kwargs))
 
 def log_debug(text, *args, **kwargs):
+    Fore, Style = _init_colors()
     print_safe(Fore.BLUE + xstr(text).format(*args, **kwargs))
     print(Style.RESET_ALL)
 
 def log_warn(text, *args, **kwargs):
+    Fore, Style = _init_colors()
     print_safe(Fore.YELLOW + xstr(text).format(*args, **kwargs))
     print(Style.RESET_ALL)
 
 def log_error(text, *args, **kwargs):
+    Fore, Style = _init_colors()
     print_safe(Fore.RED + xstr(text).format(*args, **kwargs))
     print(Style.RESET_ALL)
 
@@ -150,6 +236,198 @@ class Bunch(object):
         return self.__dict__
 
 
+def _wrap_config(value, frozen):
+    if isinstance(value, dict):
+        return ConfigBunch(value, frozen)
+    elif isinstance(value, list):
+        return ConfigList(value, frozen)
+    return value
+
+
+_key_indexes = {}
+# Distinct key sets whose case insensitive index is kept, the cache starts over once full
+KEY_INDEXES_MAX = 4096
+
+
+def _get_key_index(adict):
+    """ lower case key: key map of a dict. Json documents repeat the same key sets over and over,
+    so dicts with the same keys share one index
+    """
+    keys = tuple(adict)
+    index = _key_indexes.get(keys)
+    if index is None:
+        if len(_key_indexes) >= KEY_INDEXES_MAX:
+            _key_indexes.clear()
+        index = _key_indexes[keys] = dict((k.lower() if isinstance(k, str) else k, k) for k in keys)
+    return index
+
+
+class ConfigBunch(object):
+    """ Read optimised, case insensitive view over a (json) dict, nested dicts and lists are
+    wrapped on first access, and kept, instead of being copied upfront.
+    e.g.   config = ConfigBunch(load_json('manifest.json'))
+           config.Game.Platforms[0].name == config['game']['platforms'][0]['NAME']
+    """
+    __slots__ = ('_data', '_index', '_children', '_frozen')
+
+    def __init__(self, adict, frozen=False):
+        object.__setattr__(self, '_data', adict)
+        object.__setattr__(self, '_index', None)
+        object.__setattr__(self, '_children', None)
+        object.__setattr__(self, '_frozen', frozen)
+
+    def _find_key(self, key):
+        data = _get_slot(self, '_data')
+        if key in data:
+            return key
+        index = _get_slot(self, '_index')
+        if index is None:
+            index = _get_key_index(data)
+            object.__setattr__(self, '_index', index)
+        return index.get(key.lower() if isinstance(key, str) else key, key)
+
+    def __getitem__(self, key):
+        children = _get_slot(self, '_children')
+        if children is not None and key in children:
+            return children[key]
+        data = _get_slot(self, '_data')
+        if key not in data:
+            index = _get_slot(self, '_index')
+            if index is None:
+                index = _get_key_index(data)
+                object.__setattr__(self, '_index', index)
+            key = index.get(key.lower() if isinstance(key, str) else key, key)
+            if children is not None and key in children:
+                return children[key]
+        value = data[key]
+        if isinstance(value, (dict, list)):
+            if children is None:
+                children = {}
+                object.__setattr__(self, '_children', children)
+            value = children[key] = _wrap_config(value, _get_slot(self, '_frozen'))
+        return value
+
+    def __getattribute__(self, name):
+        # Overriding __getattribute__ rather than __getattr__ spares config keys the failed regular
+        # lookup, class members (methods, slots and dunders) still resolve the regular way
+        if name in _config_bunch_members:
+            return _get_slot(self, name)
+        children = _get_slot(self, '_children')
+        if children is not None and name in children:
+            return children[name]
+        data = _get_slot(self, '_data')
+        key = name
+        if key not in data:
+            index = _get_slot(self, '_index')
+            key = index.get(name.lower(), name) if index is not None else None
+            if children is not None and key in children:
+                return children[key]
+        if key in data:
+            value = data[key]
+            if not isinstance(value, (dict, list)):
+                return value
+        try:
+            return ConfigBunch.__getitem__(self, name)
+        except KeyError:
+            raise AttributeError(name)
+
+    def __setitem__(self, key, value):
+        if self._frozen:
+            raise AttributeError("Can't modify a frozen ConfigBunch, key '{}'".format(key))
+        real_key = self._find_key(key)
+        self._data[real_key] = value
+        # The key set may have changed, so may the index
+        object.__setattr__(self, '_index', None)
+        object.__setattr__(self, '_children', None)
+
+    def __setattr__(self, name, value):
+        self[name] = value
+
+    def __contains__(self, key):
+        return self._find_key(key) in self._data
+
+    def __iter__(self):
+        return iter(self._data)
+
+    def __len__(self):
+        return len(self._data)
+
+    def __repr__(self):
+        return 'ConfigBunch({!r})'.format(self._data)
+
+    def __getstate__(self):
+        return self._data, self._frozen
+
+    def __setstate__(self, state):
+        self.__init__(*state)
+
+    def __copy__(self):
+        return ConfigBunch(self._data, self._frozen)
+
+    def __deepcopy__(self, memo):
+        import copy
+        return ConfigBunch(copy.deepcopy(self._data, memo), self._frozen)
+
+    def get(self, key, default_value=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default_value
+
+    def keys(self):
+        return self._data.keys()
+
+    def items(self):
+        return [(key, self[key]) for key in self._data]
+
+    def freeze(self):
+        object.__setattr__(self, '_frozen', True)
+        object.__setattr__(self, '_children', None)
+        return self
+
+    def raw(self):
+        return self._data
+
+
+_get_slot = object.__getattribute__
+_config_bunch_members = frozenset(dir(ConfigBunch))
+
+
+class ConfigList(object):
+    """ List counterpart of ConfigBunch, elements are wrapped together on first access
+    """
+    __slots__ = ('_data', '_children', '_frozen')
+
+    def __init__(self, alist, frozen=False):
+        self._data = alist
+        self._children = None
+        self._frozen = frozen
+
+    def _wrap_all(self):
+        children = self._children
+        if children is None:
+            frozen = self._frozen
+            children = self._children = [_wrap_config(value, frozen) for value in self._data]
+        return children
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return ConfigList(self._data[index], self._frozen)
+        return self._wrap_all()[index]
+
+    def __iter__(self):
+        return iter(self._wrap_all())
+
+    def __len__(self):
+        return len(self._data)
+
+    def __repr__(self):
+        return 'ConfigList({!r})'.format(self._data)
+
+    def raw(self):
+        return self._data
+
+
 @ignore_exception(default_value=False)
 def ensure_dir(path):
     if not os.path.exists(path):
@@ -255,31 +533,155 @@ def has_env_var_flag(envvar):
 # Config helpers
 # ----------------------------------------------------------------------------------------
 
-# TODO: Once our Bunch has incasesentive acces we can get rid of the key.lower() class when using this
+def _convert_config(value, type, default_value):
+    try:
+        return type(value)
+    except ValueError:
+        return default_value
+
+
 def get_config(config_dict, key, type, default_value=None):
-    return ignore_exception((ValueError), default_value)(type)(config_dict.get(key, default_value))
+    return _convert_config(config_dict.get(key, default_value), type, default_value)
 
 
 def get_config_checked(config_dict, key, type, validator, default_value=None):
-    config_value = ignore_exception((ValueError), default_value)(type)(config_dict.get(key, default_value))
+    config_value = _convert_config(config_dict.get(key, default_value), type, default_value)
     if not validator(config_value):
         die("[{}] with value '{}' invalid or not found", key, config_value)
     return config_value
 
 
+_json_cache = {}
+
+
+def _get_file_stamp(path):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return st.st_mtime_ns, st.st_size
+
+
+def load_json_cached(json_path):
+    """ Same as load_json but the parsed result is kept until the file changes on disk.
+    The returned object is shared between callers, do not modify it
+    """
+    path = os.path.abspath(json_path)
+    stamp = _get_file_stamp(path)
+    cached = _json_cache.get(path)
+    if cached is not None and cached[0] == stamp:
+        return cached[1]
+    data = load_json(path) if stamp is not None else None
+    _json_cache[path] = (stamp, data)
+    return data
+
+
+def _merge_config(base, override):
+    """ Returns base updated with override, nested dicts are merged instead of replaced.
+    Neither of them is modified
+    """
+    merged = dict(base)
+    for key, value in override.items():
+        if isinstance(value, dict) and isinstance(merged.get(key), dict):
+            merged[key] = _merge_config(merged[key], value)
+        else:
+            merged[key] = value
+    return merged
+
+
+class ConfigStore(object):
+    """ Layered config: defaults < json files (in the order they were added) < env vars.
+    Nested dicts are merged key by key across layers.
+    Files are reloaded only when their mtime or size change and typed lookups of their values are
+    resolved once per reload. Env vars are named env_prefix + KEY, are only read when env_prefix is
+    set and are read again on every get, so changes to os.environ apply right away.
+    e.g.   config = ConfigStore(defaults={'retries': 3}, env_prefix='PSBUILD_').add_file('build.json')
+           config.get('retries', int)
+    """
+
+    def __init__(self, defaults=None, env_prefix=None, check_interval=0):
+        self._defaults = dict(defaults) if defaults else {}
+        self._env_prefix = env_prefix
+        self._check_interval = check_interval
+        self._paths = []
+        self._stamps = None
+        self._last_check = 0
+        self._merged = None
+        self._resolved = {}
+
+    def add_file(self, json_path):
+        self._paths.append(os.path.abspath(json_path))
+        self.invalidate()
+        return self
+
+    def invalidate(self):
+        self._stamps = None
+        self._merged = None
+        self._resolved = {}
+
+    def _refresh(self):
+        now = time.time()
+        if self._merged is not None and now - self._last_check < self._check_interval:
+            return self._merged
+        self._last_check = now
+        stamps = [_get_file_stamp(path) for path in self._paths]
+        if self._merged is None or stamps != self._stamps:
+            merged = dict(self._defaults)
+            for path in self._paths:
+                data = load_json_cached(path)
+                if isinstance(data, dict):
+                    merged = _merge_config(merged, data)
+            self._stamps = stamps
+            self._merged = merged
+            self._resolved = {}
+        return self._merged
+
+    def _get_env(self, key):
+        if self._env_prefix is None:
+            return None
+        return get_env_var(self._env_prefix + key.upper())
+
+    def get(self, key, type, default_value=None):
+        # Env vars are read on every call, only values coming from defaults and files are memoized
+        env_value = self._get_env(key)
+        if env_value is not None:
+            return _convert_config(env_value, type, default_value)
+        config = self._refresh()
+        cache_key = (key, type, default_value)
+        try:
+            return self._resolved[cache_key]
+        except KeyError:
+            pass
+        except TypeError:
+            # Unhashable default value, resolve it without caching
+            return _convert_config(config.get(key, default_value), type, default_value)
+        value = _convert_config(config.get(key, default_value), type, default_value)
+        self._resolved[cache_key] = value
+        return value
+
+    def get_checked(self, key, type, validator, default_value=None):
+        config_value = self.get(key, type, default_value)
+        if not validator(config_value):
+            die("[{}] with value '{}' invalid or not found", key, config_value)
+        return config_value
+
+    def raw(self):
+        return self._refresh()
+
+
 # ----------------------------------------------------------------------------------------
 # Git helpers
 # ----------------------------------------------------------------------------------------
 
-def gather_repos(root_path):
+def gather_repos(root_path, workers=1):
+    from git import Repo
     repos = []
-    for dirname, dirnames, filenames in os.walk(root_path):
-        if not 'node_modules' in dirname:
-            for int_dir in dirnames:
-                if '.git' in int_dir:
-                    abspath = os.path.abspath(dirname)
-                    repo = Repo(abspath)
-                    repos.append(repo)
+    for dirname, dirs, _ in walk_dir(root_path, exclude=['*node_modules*'], workers=workers,
+                                     ignore_errors=True):
+        if any(entry.name == '.git' for entry in dirs):
+            repos.append(Repo(os.path.abspath(dirname)))
+            # Nothing to find inside the git internals
+            dirs[:] = [entry for entry in dirs if entry.name != '.git']
     return repos
 
 def git_clean(repo, flags='-fd'):
@@ -357,11 +759,76 @@ def git_delete_tag_repo(repo, tag, local=True, remote=True, fetch=True):
             pass
 
 
-def git_pull_or_clone(repo_path, repo_git, branch="master", clean=True):
+GIT_MIRRORS_ENV = 'PSPYLIB_GIT_MIRRORS'
+
+
+def git_mirror_path(repo_git, mirror_root=None):
+    name = re.sub(r'[^A-Za-z0-9._-]', '_', os.path.basename(repo_git.rstrip('/')))
+    if name.endswith('.git'):
+        name = name[:-len('.git')]
+    digest = hashlib.sha1(repo_git.encode('utf8')).hexdigest()[:16]
+    return os.path.join(mirror_root or os.path.join(get_cache_root(), 'git-mirrors'), '{}-{}.git'.format(name, digest))
+
+
+def git_update_mirror(repo_git, mirror_root=None):
+    """ Creates or fetches the local bare mirror of repo_git and returns its path, safe to call from concurrent processes
+    """
+    from git import Repo
+    mirror_path = git_mirror_path(repo_git, mirror_root)
+    with file_lock(mirror_path + '.lock'):
+        if os.path.isdir(mirror_path):
+            log_info("Updating mirror {}", mirror_path)
+            Repo(mirror_path).git.remote('update', '--prune')
+        else:
+            log_info("Creating mirror of {} in {}", repo_git, mirror_path)
+            tmp_path = '{}.{}.tmp'.format(mirror_path, get_uuid())
+            try:
+                mirror = Repo.clone_from(repo_git, tmp_path, mirror=True)
+                # Auto gc must run while we hold the lock, never detached while someone clones from the mirror
+                mirror.git.config('gc.autoDetach', 'false')
+                os.rename(tmp_path, mirror_path)
+            finally:
+                if os.path.isdir(tmp_path):
+                    purge_dir(tmp_path)
+    return mirror_path
+
+
+def _git_clone_from(repo_git, repo_path, branch=None, mirror=None, depth=None, filter=None, sparse_paths=None):
+    from git import Repo
+    if mirror is None:
+        mirror = has_env_var_flag(GIT_MIRRORS_ENV)
+
+    options = {}
+    if branch:
+        options['branch'] = branch
+    if depth:
+        options['depth'] = depth
+    if filter:
+        options['filter'] = filter
+    if sparse_paths:
+        options['sparse'] = True
+
+    if mirror:
+        mirror_path = git_update_mirror(repo_git, mirror if isinstance(mirror, str) else None)
+        # Borrow the objects we already have from the mirror and copy them over, so the clone doesn't
+        # depend on the mirror afterwards
+        with file_lock(mirror_path + '.lock', shared=True):
+            repo = Repo.clone_from(repo_git, repo_path, reference=mirror_path, dissociate=True, **options)
+    else:
+        repo = Repo.clone_from(repo_git, repo_path, **options)
+
+    if sparse_paths:
+        repo.git.sparse_checkout('set', *sparse_paths)
+    return repo
+
+
+def git_pull_or_clone(repo_path, repo_git, branch="master", clean=True, mirror=None, depth=None, filter=None,
+                      sparse_paths=None):
     if not os.path.isdir(repo_path) or not os.path.isdir(os.path.join(repo_path, '.git')):
         log_info("Cloning repo {}", repo_path)
-        Repo.clone_from(repo_git, repo_path)
+        _git_clone_from(repo_git, repo_path, mirror=mirror, depth=depth, filter=filter, sparse_paths=sparse_paths)
     else:
+        from git import Repo
         repo = Repo(repo_path)
         if os.path.isfile(os.path.join(repo_path, '.git', 'index.lock')):
             os.remove(os.path.join(repo_path, '.git', 'index.lock'))
@@ -375,11 +842,16 @@ def git_pull_or_clone(repo_path, repo_git, branch="master", clean=True):
                 repo.git.pull('--no-edit', 'origin', branch)
 
 
-def git_clone(repo_git, repo_path, branch="master"):
-    Repo.clone_from(repo_git, repo_path, branch=branch)
+def git_clone(repo_git, repo_path, branch="master", mirror=None, depth=None, filter=None, sparse_paths=None):
+    """ Clones repo_git, optionally shallow (depth), partial (filter, e.g. 'blob:none') or restricted to sparse_paths.
+    With mirror (True, a mirrors root dir or the PSPYLIB_GIT_MIRRORS env flag when None) the objects come from a
+    shared local mirror and only what the mirror lacks is downloaded
+    """
+    return _git_clone_from(repo_git, repo_path, branch, mirror, depth, filter, sparse_paths)
 
 
 def git_commit(repo_path, files, message, branch, push=True):
+    from git import Repo
     if os.path.isdir(os.path.join(repo_path, '.git')):
         repo = Repo(repo_path)
         # Add all files one by one
@@ -395,6 +867,7 @@ def git_commit(repo_path, files, message, branch, push=True):
 
 
 def git_push_and_add(repo_path, message, branch):
+    from git import Repo
     if os.path.isdir(os.path.join(repo_path, '.git')):
         repo = Repo(repo_path)
         repo.git.add('.')
@@ -448,6 +921,7 @@ def git_checkout_tracked(repo, branch_name):
 
 
 def git_create_branch(repo, branch_name):
+    from git import Head
     repo.remote().push(Head.create(repo, branch_name))
 
 
@@ -498,15 +972,127 @@ def get_file_size_mb(path):
     return get_file_size(path) / (1024 * 1024.0)
 
 
+def _remove_tree(dir_path):
+    def del_evenReadonly(action, name, exc):
+        if not os.path.lexists(name):
+            return  # Someone else deleted it meanwhile
+        if os.path.islink(name):
+            os.remove(name)  # chmod would change the target of the link instead
+            return
+        os.chmod(name, stat.S_IWRITE)
+        os.remove(name)
+
+    shutil.rmtree(dir_path, onerror=del_evenReadonly)
+
+
 def purge_dir(dir_path):
     if os.path.isdir(dir_path):
         log_info("Purging dir {}", dir_path)
+        _remove_tree(dir_path)
+
 
-        def del_evenReadonly(action, name, exc):
-            os.chmod(name, stat.S_IWRITE)
-            os.remove(name)
+# Dirs with more entries than this are deleted by a detached process
+PURGE_INLINE_MAX_ENTRIES = 1000
+# Trashed dirs older than this belong to purges that died before finishing
+TRASH_ABANDONED_SECONDS = 60 * 60
 
-        shutil.rmtree(dir_path, onerror=del_evenReadonly)
+
+def _get_trash_name():
+    return '.pspylib-trash-{}'.format(os.getuid()) if hasattr(os, 'getuid') else '.pspylib-trash'
+
+
+def _get_trash_dir(parent_path, create=True):
+    """
+    Trash dir of the current user under parent_path, created as a 0700 directory when create is set.
+    Returns None when it's missing or isn't a private directory owned by us: parent_path may be a world
+    writable dir like /tmp, where anyone could have placed a link or dir under that name beforehand
+    """
+    path = os.path.join(parent_path, _get_trash_name())
+    if create:
+        try:
+            os.mkdir(path, 0o700)
+        except FileExistsError:
+            pass
+        except OSError:
+            return None
+    try:
+        st = os.lstat(path)
+    except OSError:
+        return None
+    if not stat.S_ISDIR(st.st_mode) or (hasattr(os, 'getuid') and (st.st_uid != os.getuid() or st.st_mode & 0o077)):
+        log_warn("Trash dir {} is not a private directory of the current user, ignoring it", path)
+        return None
+    return path
+
+
+def _count_entries_up_to(dir_path, limit):
+    count = 0
+    for _, dirs, files in walk_dir(dir_path, ignore_errors=True):
+        count += len(dirs) + len(files)
+        if count > limit:
+            break
+    return count
+
+
+def _spawn_purge(paths):
+    pspylib_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    command = [sys.executable, '-c', 'import sys; sys.path.insert(0, sys.argv[1]); '
+                                     'from pspylib.common import _remove_tree; '
+                                     '[_remove_tree(path) for path in sys.argv[2:]]',
+               pspylib_root] + paths
+    if is_windows():
+        DETACHED_PROCESS = 0x00000008
+        subprocess.Popen(command, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                         creationflags=DETACHED_PROCESS)
+    else:
+        subprocess.Popen(command, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                         start_new_session=True)
+
+
+def purge_dir_async(dir_path, max_inline_entries=PURGE_INLINE_MAX_ENTRIES):
+    """ Deletes dir_path without logging. Dirs with up to max_inline_entries entries are deleted right away,
+    bigger ones are moved to the trash dir next to them and deleted from a detached process, so nobody waits
+    for big deletions. See sweep_trash for trash left behind by purges that didn't finish
+    """
+    if not os.path.isdir(dir_path):
+        return
+    if _count_entries_up_to(dir_path, max_inline_entries) <= max_inline_entries:
+        _remove_tree(dir_path)
+        return
+    trash_dir = _get_trash_dir(os.path.dirname(os.path.abspath(dir_path)))
+    if trash_dir is None:
+        _remove_tree(dir_path)
+        return
+    trash_path = os.path.join(trash_dir, get_uuid())
+    try:
+        os.rename(dir_path, trash_path)
+    except OSError:
+        _remove_tree(dir_path)
+        return
+    _spawn_purge([trash_path])
+
+
+def sweep_trash(parent_path, max_age=TRASH_ABANDONED_SECONDS):
+    """ Deletes, from a detached process, the dirs purge_dir_async trashed under parent_path more than
+    max_age seconds ago, whose purge must have died
+    """
+    trash_dir = _get_trash_dir(parent_path, create=False)
+    if trash_dir is None:
+        return
+    now = time.time()
+    abandoned = []
+    for entry in scan_dir(trash_dir, files=False, ignore_errors=True):
+        if entry.is_symlink():
+            continue  # Only purge_dir_async puts things there, and it never moves links
+        try:
+            st = entry.stat(follow_symlinks=False)
+        except OSError:
+            continue
+        # Moving a dir to the trash updates its ctime
+        if now - max(st.st_mtime, st.st_ctime) > max_age:
+            abandoned.append(entry.path)
+    if abandoned:
+        _spawn_purge(abandoned)
 
 
 def remove_file(file_path):
@@ -515,14 +1101,82 @@ def remove_file(file_path):
         os.remove(file_path)
 
 
+def _match_any(name, patterns):
+    return any(fnmatch.fnmatch(name, pattern) for pattern in patterns)
+
+
+def _scan_entries(dir_path, exclude=None, ignore_errors=True):
+    try:
+        with os.scandir(dir_path) as it:
+            entries = [entry for entry in it if not exclude or not _match_any(entry.name, exclude)]
+    except OSError:
+        if not ignore_errors:
+            raise
+        return dir_path, [], []
+    dirs, files = [], []
+    for entry in entries:
+        if entry.is_dir():
+            dirs.append(entry)
+        elif entry.is_file():
+            files.append(entry)
+    return dir_path, dirs, files
+
+
+def walk_dir(root, exclude=None, workers=1, ignore_errors=False):
+    """ os.walk alike yielding (dir_path, dir_entries, file_entries) with the os.DirEntry objects, so
+    type checks come from the directory listing and stat calls are only done (and cached) on demand.
+    Directories are visited top-down in the same order as os.walk, removing entries from dir_entries
+    prunes them. Names matching any exclude glob are skipped and workers > 1 lists subdirectories ahead
+    in parallel, which pays off on network filesystems. Symlinked dirs are reported but not followed.
+    Unreadable subdirectories are skipped, root raises unless ignore_errors is set.
+    """
+    if workers > 1:
+        from concurrent.futures import ThreadPoolExecutor
+    pool = ThreadPoolExecutor(workers) if workers > 1 else None
+    try:
+        listing = _scan_entries(root, exclude, ignore_errors)
+        pending = []
+        while True:
+            yield listing
+            children = [entry.path for entry in listing[1] if not entry.is_symlink()]
+            if pool:
+                children = [pool.submit(_scan_entries, path, exclude) for path in children]
+            pending.extend(reversed(children))
+            if not pending:
+                break
+            child = pending.pop()
+            listing = child.result() if pool else _scan_entries(child, exclude)
+    finally:
+        if pool:
+            pool.shutdown()
+
+
+def scan_dir(root, recursive=False, include=None, exclude=None, files=True, dirs=True, workers=1,
+             ignore_errors=False):
+    """ Lazily yields the os.DirEntry objects under root, include/exclude are globs matched against
+    entry names, excluded directories aren't traversed. A missing or unreadable root raises unless
+    ignore_errors is set.
+    e.g.   [entry.path for entry in scan_dir(path, recursive=True, include=['*.json'], dirs=False)]
+    """
+    for _, dir_entries, file_entries in walk_dir(root, exclude, workers if recursive else 1, ignore_errors):
+        if dirs:
+            for entry in dir_entries:
+                if not include or _match_any(entry.name, include):
+                    yield entry
+        if files:
+            for entry in file_entries:
+                if not include or _match_any(entry.name, include):
+                    yield entry
+        if not recursive:
+            break
+
+
 def list_dirs(dir_path):
-    return [os.path.join(dir_path, dir_name) for dir_name in os.listdir(dir_path) if
-            os.path.isdir(os.path.join(dir_path, dir_name))]
+    return [entry.path for entry in scan_dir(dir_path, files=False)]
 
 
 def list_files(dir_path):
-    return [os.path.join(dir_path, file_name) for file_name in os.listdir(dir_path) if
-            os.path.isfile(os.path.join(dir_path, file_name))]
+    return [entry.path for entry in scan_dir(dir_path, dirs=False)]
 
 
 def copy_file(src, dst):
@@ -533,7 +1187,6 @@ def copy_file(src, dst):
     shutil.copy2(src, dst)
 
 
-# TODO: Bunch must have in case sensitive access too
 def load_json(json_path):
     if not os.path.isfile(json_path) or not os.access(json_path, os.R_OK):
         return None
@@ -563,12 +1216,84 @@ def to_unix_path(path):
 def to_module_path(path):
     return os.path.splitext(to_unix_path(path))[0].replace("/", ".")
     
+@contextmanager
+def open_mmap(path):
+    """ Read only mmap of a file, empty files (which can't be mapped) yield an empty bytes object
+    """
+    with open(path, 'rb', 0) as file:
+        if os.fstat(file.fileno()).st_size == 0:
+            yield b''
+        else:
+            with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as s:
+                yield s
+
+
 def file_contains(path, pattern):
-    with open(path, 'rb', 0) as file, \
-        mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as s:
-            if s.find(pattern) != -1:
-                return True
-    return False
+    with open_mmap(path) as s:
+        return s.find(pattern) != -1
+
+
+def tail_file(path, lines=10, encoding='utf8'):
+    """ Last lines of a file without their line break, scanning backwards so only the tail pages are read
+    """
+    if lines <= 0:
+        return []
+    with open_mmap(path) as s:
+        end = len(s)
+        if end == 0:
+            return []
+        if s[end - 1:end] == b'\n':
+            end -= 1
+        pos = end
+        for _ in range(lines):
+            pos = s.rfind(b'\n', 0, pos)
+            if pos == -1:
+                break
+        # Only the final line break was dropped, blank lines before it count as lines
+        return [line.decode(encoding, errors='replace').rstrip('\r') for line in s[pos + 1:end].split(b'\n')]
+
+
+def iter_file_lines(path, encoding='utf8'):
+    """ Lazily iterates the lines of a file without their line break
+    """
+    with open(path, 'r', encoding=encoding, errors='replace') as f:
+        for line in f:
+            yield line.rstrip('\r\n')
+
+
+def search_file(path, pattern, flags=0, encoding='utf8'):
+    """ Lazily yields every line of a file matching a regex, the file is searched through an mmap
+    e.g.   next(search_file(log_path, r'error|exception', re.IGNORECASE), None)
+    """
+    if isinstance(pattern, str):
+        pattern = pattern.encode(encoding)
+    regex = re.compile(pattern, flags)
+    with open_mmap(path) as s:
+        pos = 0
+        while True:
+            match = regex.search(s, pos)
+            if match is None:
+                return
+            start = s.rfind(b'\n', 0, match.start()) + 1
+            end = s.find(b'\n', match.end())
+            if end == -1:
+                end = len(s)
+            yield s[start:end].decode(encoding, errors='replace').rstrip('\r')
+            pos = end + 1
+            if pos > len(s):
+                return
+
+
+def find_in_file(path, pattern, flags=0, encoding='utf8'):
+    return next(search_file(path, pattern, flags, encoding), None)
+
+
+def hash_file(path, algorithm='sha256', chunk_size=1024 * 1024):
+    digest = hashlib.new(algorithm)
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
 
 
 # ----------------------------------------------------------------------------------------
@@ -592,6 +1317,7 @@ def get_shell_ext():
 
 
 def kill_proc_tree(pid, including_parent=True):
+    import psutil
     parent = psutil.Process(pid)
     for child in parent.children(recursive=True):
         log_info("killing process '{}' with pid '{}' and cmd '{}'", child.name(), child.pid, child.cmdline())
@@ -601,6 +1327,36 @@ def kill_proc_tree(pid, including_parent=True):
         parent.kill()
 
 
+@contextmanager
+def file_lock(lock_path, shared=False):
+    """ Inter process lock on lock_path held while in the context, shared locks are only honored on unix
+    """
+    ensure_dir(os.path.dirname(lock_path))
+    with open(lock_path, 'a+') as f:
+        if is_windows():
+            import msvcrt
+            f.seek(0)
+            while True:
+                try:
+                    # LK_LOCK retries for 10 seconds before giving up
+                    msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+                    break
+                except OSError:
+                    pass
+            try:
+                yield
+            finally:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+        else:
+            import fcntl
+            fcntl.flock(f.fileno(), fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+
 @ignore_exception(default_value="127.0.0.1")
 def get_private_ip():
     import socket
@@ -686,12 +1442,375 @@ def execute_script_safe(command_args, cwd=None):
     return execute_script(command_args, cwd)
 
 
+# ----------------------------------------------------------------------------------------
+# Result cache
+# ----------------------------------------------------------------------------------------
+
+CACHE_DIR_ENV = 'PSPYLIB_CACHE_DIR'
+RESULT_CACHE_DISABLE_ENV = 'PSPYLIB_NO_CACHE'
+
+
+def get_cache_root():
+    return get_env_var(CACHE_DIR_ENV) or os.path.join(os.path.expanduser('~'), '.cache', 'pspylib')
+
+
+def _fingerprint_stat(path, st, hash_contents):
+    return hash_file(path) if hash_contents else [st.st_size, st.st_mtime_ns]
+
+
+def fingerprint_path(path, hash_contents=False):
+    """ Fingerprint of a file, or of every file inside a directory, by size and mtime or by content hash.
+    None when the path doesn't exist
+    """
+    if os.path.isdir(path):
+        return sorted([os.path.relpath(entry.path, path), _fingerprint_stat(entry.path, entry.stat(), hash_contents)]
+                      for entry in scan_dir(path, recursive=True, dirs=False))
+    try:
+        return _fingerprint_stat(path, os.stat(path), hash_contents)
+    except OSError:
+        return None
+
+
+def _copy_atomic(src, dst):
+    tmp_path = '{}.{}.tmp'.format(dst, get_uuid())
+    try:
+        shutil.copyfile(src, tmp_path)
+        os.replace(tmp_path, dst)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def _write_json_atomic(adict, json_path):
+    tmp_path = '{}.{}.tmp'.format(json_path, get_uuid())
+    write_json(adict, tmp_path)
+    os.replace(tmp_path, json_path)
+
+
+class ResultCache(object):
+    """ Local cache of results of idempotent executions. An execution is described by a key made of its
+    name, args, env vars and input files. Its result and output files are stored under that key, output
+    contents go in a content addressed blob store so identical outputs are kept once. Least recently used
+    entries are evicted when the cache grows over max_size_mb.
+    e.g.   key = cache.make_key('convert', args, inputs=[src])
+           result = cache.get(key)  # restores the outputs on a hit
+           if result is None:
+               result = convert(src, dst)
+               cache.put(key, result, outputs=[dst])
+    """
+    # Blobs younger than this are never garbage collected, their entry may still be being written
+    BLOB_GRACE_SECONDS = 60
+
+    def __init__(self, cache_dir=None, max_size_mb=2048):
+        self.cache_dir = cache_dir or os.path.join(get_cache_root(), 'results')
+        self.max_size = max_size_mb * 1024 * 1024
+
+    def _entry_path(self, key):
+        return os.path.join(self.cache_dir, 'entries', key + '.json')
+
+    def _blob_path(self, digest):
+        return os.path.join(self.cache_dir, 'blobs', digest[:2], digest)
+
+    def make_key(self, name, args=None, env=None, inputs=(), hash_inputs=False):
+        description = {
+            'name': name,
+            'args': args,
+            'env': env,
+            'inputs': [[os.path.abspath(path), fingerprint_path(os.path.abspath(path), hash_inputs)] for path in inputs],
+        }
+        return hashlib.sha256(json.dumps(description, sort_keys=True, default=str).encode('utf8')).hexdigest()
+
+    def get(self, key):
+        """ Result stored for key with its output files restored, None on a miss
+        """
+        entry_path = self._entry_path(key)
+        entry = ignore_exception((ValueError), None)(load_json)(entry_path)
+        if entry is None:
+            return None
+        try:
+            for path, digest, mode in entry['files']:
+                ensure_dir(os.path.dirname(path))
+                blob_path = self._blob_path(digest)
+                if os.path.exists(path):
+                    os.remove(path)
+                shutil.copyfile(blob_path, path)
+                os.chmod(path, mode)
+            os.utime(entry_path)
+        except OSError:
+            # Evicted while we were restoring it
+            return None
+        return entry['result']
+
+    def put(self, key, result, outputs=()):
+        """ Stores result and the output paths (files or directories) for key, nothing is stored if an output is missing
+        """
+        files = []
+        for output in outputs:
+            path = os.path.abspath(output)
+            if os.path.isdir(path):
+                files.extend(entry.path for entry in scan_dir(path, recursive=True, dirs=False))
+            elif os.path.isfile(path):
+                files.append(path)
+            else:
+                log_warn("Not caching result, output {} is missing", path)
+                return False
+
+        stored = []
+        for path in files:
+            digest = hash_file(path)
+            blob_path = self._blob_path(digest)
+            if os.path.isfile(blob_path):
+                os.utime(blob_path)
+            else:
+                ensure_dir(os.path.dirname(blob_path))
+                _copy_atomic(path, blob_path)
+            stored.append([path, digest, stat.S_IMODE(os.stat(path).st_mode)])
+
+        ensure_dir(os.path.dirname(self._entry_path(key)))
+        _write_json_atomic({'result': result, 'files': stored}, self._entry_path(key))
+        self.evict()
+        return True
+
+    def evict(self):
+        """ Drops least recently used entries until the cache fits in max_size, then the blobs nobody references
+        """
+        entries_dir = os.path.join(self.cache_dir, 'entries')
+        blobs_dir = os.path.join(self.cache_dir, 'blobs')
+        if not os.path.isdir(entries_dir) or not os.path.isdir(blobs_dir):
+            return
+        blobs = dict((entry.name, entry.stat()) for entry in scan_dir(blobs_dir, recursive=True, dirs=False))
+        if sum(st.st_size for st in blobs.values()) <= self.max_size:
+            return
+
+        entries = sorted(scan_dir(entries_dir, include=['*.json'], dirs=False), key=lambda e: e.stat().st_mtime,
+                         reverse=True)
+        kept_blobs = set()
+        size = 0
+        for entry in entries:
+            data = ignore_exception((ValueError, OSError), None)(load_json)(entry.path)
+            digests = set(digest for _, digest, _ in data['files']) if data else set()
+            size += sum(blobs[digest].st_size for digest in digests - kept_blobs if digest in blobs)
+            if size > self.max_size:
+                ignore_exception((OSError))(os.remove)(entry.path)
+            else:
+                kept_blobs.update(digests)
+
+        now = time.time()
+        for digest, st in blobs.items():
+            if digest not in kept_blobs and now - st.st_mtime > self.BLOB_GRACE_SECONDS:
+                ignore_exception((OSError))(os.remove)(self._blob_path(digest))
+
+
+def execute_cmd_cached(command, inputs=(), outputs=(), env_vars=(), env=None, cwd=None, encoding='utf8', silent=False,
+                       hash_inputs=False, cache=None):
+    """ execute_cmd for commands whose result only depends on the command line, the given env vars and input paths.
+    Output is always captured. Successful runs are stored and later restored from the cache, outputs included,
+    instead of running again. Set PSPYLIB_NO_CACHE to bypass the cache
+    e.g.   execute_cmd_cached(['git', 'ls-remote', '--tags', url]).stdout
+    """
+    if has_env_var_flag(RESULT_CACHE_DISABLE_ENV):
+        return execute_cmd(command, env=env, cwd=cwd, capture_output=True, encoding=encoding, silent=silent)
+
+    cache = cache or ResultCache()
+    base_dir = cwd or os.getcwd()
+    inputs = [os.path.join(base_dir, path) for path in inputs]
+    outputs = [os.path.join(base_dir, path) for path in outputs]
+    command_line = command if isinstance(command, str) else join_args(command)
+    env_values = dict((var, (env if env is not None else os.environ).get(var)) for var in env_vars)
+    key = cache.make_key(command_line, [os.path.abspath(base_dir), encoding], env_values, inputs, hash_inputs)
+
+    result = cache.get(key)
+    if result is not None:
+        if not silent:
+            log_info("Using cached result of command {start}{command}{end}", start=bcolors.OKGREEN,
+                     command=command_line, end=bcolors.ENDC)
+        return ProcessOutput(result)
+
+    output = execute_cmd(command, env=env, cwd=cwd, capture_output=True, encoding=encoding, silent=silent)
+    if output.rc == EXIT_CODE_SUCCESS:
+        cache.put(key, output.raw(), outputs)
+    return output
+
+
+# ----------------------------------------------------------------------------------------
+# Scratch space
+# ----------------------------------------------------------------------------------------
+
+SCRATCH_SHM_PATH = '/dev/shm'
+SCRATCH_NO_SHM_ENV = 'PSPYLIB_SCRATCH_NO_SHM'
+SCRATCH_MIN_FREE_MB_ENV = 'PSPYLIB_SCRATCH_MIN_FREE_MB'
+SCRATCH_MIN_FREE_MB = 2048
+
+
+class CacheArea(object):
+    """ Named, size capped directory of entries that survives across runs. Entries are filled in a
+    private directory that is moved into place when committed, so concurrent fills of the same key
+    never mix. Least recently used entries are evicted on commit when the area grows over max_size_mb.
+    e.g.   sdk_dir = area.get(version)
+           if sdk_dir is None:
+               unpack(sdk_archive, area.create(version))
+               sdk_dir = area.commit(version)
+    """
+    READY_SUFFIX = '.ready'
+    # Uncommitted entries older than this are leftovers of crashed runs
+    ABANDONED_SECONDS = 24 * 60 * 60
+
+    def __init__(self, name, max_size_mb=1024, root=None):
+        self.name = name
+        self.path = os.path.join(root or os.path.join(get_cache_root(), 'areas'), name)
+        self.max_size = max_size_mb * 1024 * 1024
+        self._filling = {}
+
+    def _entry_path(self, key):
+        if not key or os.path.basename(key) != key or key.endswith(self.READY_SUFFIX):
+            raise ValueError("Invalid cache area key '{}'".format(key))
+        return os.path.join(self.path, key)
+
+    def _lock(self):
+        return file_lock(self.path + '.lock')
+
+    def get(self, key):
+        """ Path of the committed entry for key, None if there's none
+        """
+        entry_path = self._entry_path(key)
+        try:
+            os.utime(entry_path + self.READY_SUFFIX)
+        except OSError:
+            return None
+        return entry_path
+
+    def create(self, key):
+        """ Empty directory to fill in for key, it's not visible through get until committed
+        """
+        import tempfile
+        self._entry_path(key)
+        ensure_dir(self.path)
+        fill_path = tempfile.mkdtemp(prefix='.{}-'.format(key), dir=self.path)
+        self._filling[key] = fill_path
+        return fill_path
+
+    def commit(self, key):
+        """ Moves the directory returned by create(key) into place and returns the entry path
+        """
+        entry_path = self._entry_path(key)
+        if key not in self._filling:
+            raise ValueError("Cache area entry '{}' was not created".format(key))
+        fill_path = self._filling.pop(key)
+        size = sum(entry.stat().st_size for entry in scan_dir(fill_path, recursive=True, dirs=False))
+        with self._lock():
+            if os.path.isfile(entry_path + self.READY_SUFFIX):
+                os.remove(entry_path + self.READY_SUFFIX)
+            purge_dir_async(entry_path)
+            os.rename(fill_path, entry_path)
+            write_json({'size': size}, entry_path + self.READY_SUFFIX)
+            self._evict(keep=key)
+        return entry_path
+
+    def evict(self):
+        with self._lock():
+            self._evict()
+
+    def _evict(self, keep=None):
+        if not os.path.isdir(self.path):
+            return
+        markers = []
+        for entry in scan_dir(self.path, include=['*' + self.READY_SUFFIX], dirs=False):
+            data = ignore_exception((ValueError, OSError), None)(load_json)(entry.path)
+            markers.append((entry.stat().st_mtime, entry.name[:-len(self.READY_SUFFIX)], (data or {}).get('size', 0)))
+
+        total = 0
+        for _, key, size in sorted(markers, reverse=True):
+            if total + size > self.max_size and key != keep:
+                os.remove(os.path.join(self.path, key + self.READY_SUFFIX))
+                purge_dir_async(os.path.join(self.path, key))
+            else:
+                total += size
+
+        committed = set(key for _, key, _ in markers)
+        trash_name = _get_trash_name()
+        now = time.time()
+        for entry in scan_dir(self.path, files=False):
+            if entry.name not in committed and entry.name != trash_name and \
+                    now - entry.stat().st_mtime > self.ABANDONED_SECONDS:
+                purge_dir_async(entry.path)
+        sweep_trash(self.path)
+
+
+def _available_memory():
+    """ Bytes of memory that can be used without swapping, None when unknown. Read from /proc/meminfo
+    on Linux and from the free pages count elsewhere, psutil is too slow to import for every tool run
+    """
+    try:
+        with open('/proc/meminfo') as f:
+            for line in f:
+                if line.startswith('MemAvailable:'):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError, IndexError):
+        pass
+    try:
+        return os.sysconf('SC_AVPHYS_PAGES') * os.sysconf('SC_PAGE_SIZE')
+    except (AttributeError, ValueError, OSError):
+        return None
+
+
+def _shm_available(min_free_mb):
+    if is_windows() or has_env_var_flag(SCRATCH_NO_SHM_ENV) or not os.path.isdir(SCRATCH_SHM_PATH) or \
+            not os.access(SCRATCH_SHM_PATH, os.W_OK):
+        return False
+    min_free = min_free_mb * 1024 * 1024
+    available = _available_memory()
+    return available is not None and available >= min_free and shutil.disk_usage(SCRATCH_SHM_PATH).free >= min_free
+
+
+class ScratchSpace(str):
+    """ Temporary directory given to tools. It's the directory path itself, so it can be used as such,
+    and it lives in memory (/dev/shm) when enough memory is free. Named persistent caches are reachable
+    through cache(name)
+    """
+
+    def __new__(cls, path, in_memory=False):
+        scratch = str.__new__(cls, path)
+        scratch.in_memory = in_memory
+        return scratch
+
+    def make_dir(self, name=None):
+        import tempfile
+        if name is None:
+            return tempfile.mkdtemp(dir=self)
+        path = os.path.join(self, name)
+        ensure_dir(path)
+        return path
+
+    def cache(self, name, max_size_mb=1024):
+        return CacheArea(name, max_size_mb)
+
+    def cleanup(self, wait=False):
+        if wait:
+            purge_dir(self)
+        else:
+            purge_dir_async(self)
+
+
+def create_scratch_space(min_free_mb=None):
+    """ New ScratchSpace, on tmpfs if it and the system have at least min_free_mb (PSPYLIB_SCRATCH_MIN_FREE_MB,
+    2048 by default) free, on the regular temp dir otherwise. PSPYLIB_SCRATCH_NO_SHM forces the latter
+    """
+    import tempfile
+    if min_free_mb is None:
+        min_free_mb = get_config(os.environ, SCRATCH_MIN_FREE_MB_ENV, int, SCRATCH_MIN_FREE_MB)
+    in_memory = _shm_available(min_free_mb)
+    parent_path = SCRATCH_SHM_PATH if in_memory else tempfile.gettempdir()
+    sweep_trash(parent_path)
+    return ScratchSpace(tempfile.mkdtemp(prefix='pspylib-', dir=parent_path), in_memory)
+
+
 # ----------------------------------------------------------------------------------------
 # Input handling
 # ----------------------------------------------------------------------------------------
 
 def input(prompt, default=None):
     import builtins
+    _init_readline()
     if default:
         return builtins.input("{} [{}]: ".format(prompt, default)) or default
     return builtins.input("{}: ".format(prompt))
@@ -723,14 +1842,25 @@ def input_str(prompt, default=""):
 # Setup tools
 # ----------------------------------------------------------------------------------------
 
-class PackageInfo(object):
-    def __init__(self, packageName):
+_package_metadata = {}
+
+
+def get_package_metadata(packageName):
+    """ Metadata headers of an installed distribution, cached for the whole process.
+    Raises importlib.metadata.PackageNotFoundError (an ImportError) when the package is not installed
+    """
+    if packageName not in _package_metadata:
         try:
-            pkgInfo = message_from_string(pkg_resources.get_distribution(packageName).get_metadata('METADATA'))
-        except:
-            pkgInfo = message_from_string(pkg_resources.get_distribution(packageName).get_metadata('PKG-INFO'))
+            from importlib.metadata import metadata
+        except ImportError:
+            from importlib_metadata import metadata
+        _package_metadata[packageName] = metadata(packageName).items()
+    return _package_metadata[packageName]
 
-        for item in pkgInfo.items():
+
+class PackageInfo(object):
+    def __init__(self, packageName):
+        for item in get_package_metadata(packageName):
             if item[0] == "Version":
                 self.version = item[1]
             elif item[0] == "Name":
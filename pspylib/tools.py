@@ -1,12 +1,20 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 # Copyright (C) 2018 - Playspace
-import inspect
-import argcomplete
 import tempfile
 import subprocess
+import socket
+import signal
+import array
+import struct
+import hashlib
+import traceback
 
 from pspylib.common import *
+from pspylib.common import _LazyImport
+
+inspect = _LazyImport('inspect')
+argcomplete = _LazyImport('argcomplete')
 
 __version__ = "1.0.0"
 __author__ = "Playspace Dev Team"
@@ -16,9 +24,18 @@ __description__ = "Flexible CLI tool - v{version} {copyright}"
 registered_tools = {}
 instanced_tools = {}
 tool_origin = None
+tool_parser = None
+
+PIPELINE_TOOL_NAME = 'pipeline'
 
 
 class ITool:
+    """
+    Base of every tool. tmpdir is a ScratchSpace: the path of a temporary directory, in memory when
+    possible, that is deleted once main_tool is done. Use tmpdir.cache(name) for data worth keeping
+    across runs
+    """
+
     def __init__(self, parser, tmpdir):
         raise NotImplementedError(
             'Tool "{}" must implement own __init__(self, parser, tmpdir) method'.format(str(self.__class__)))
@@ -35,13 +52,12 @@ def get_available_tools():
 def find_tools(root):
     root_package = os.path.basename(root)
     packages = []
-    for dirname, _, filenames in os.walk(root):
-        if '__init__.py' in filenames:
-            for package in filenames:
-                if '__init__.py' != package:
-                    file_path = os.path.join(dirname, package)
-                    if file_contains(file_path, b'register_tool'):
-                        packages.append('.'.join([root_package, to_module_path(os.path.relpath(file_path, root))]))
+    for _, _, files in walk_dir(root, exclude=['__pycache__']):
+        if any(entry.name == '__init__.py' for entry in files):
+            for entry in files:
+                if '__init__.py' != entry.name:
+                    if file_contains(entry.path, b'register_tool'):
+                        packages.append('.'.join([root_package, to_module_path(os.path.relpath(entry.path, root))]))
     for package in packages:
         try:
             __import__(package)
@@ -51,6 +67,8 @@ def find_tools(root):
 
 def init_tools(root, parser, tmpdir):
     find_tools(root)
+    if PIPELINE_TOOL_NAME not in registered_tools:
+        registered_tools[PIPELINE_TOOL_NAME] = {'cls': PipelineTool, 'help': 'Runs a pipeline of tools described in a json file'}
     for tool_name in registered_tools:
         tool_parser = parser.add_parser(tool_name, help=registered_tools[tool_name]['help'])
         try:
@@ -72,7 +90,7 @@ def register_tool(name=None, help=None):
     """
 
     def toolify(cls):
-        if inspect.isclass(cls):
+        if isinstance(cls, type):
             tool_name = name
             if tool_name is None:
                 tool_name = cls.__name__
@@ -85,13 +103,274 @@ def register_tool(name=None, help=None):
 
     return toolify
 
-def main_tool(root, argv=None, description=__description__, version=__version__, copyright=__copyright__, author=__author__, origin=None):
-    global tool_origin
-    tool_origin = origin
+def cache_tool_result(inputs=None, outputs=None, env_vars=(), hash_inputs=False, cache=None):
+    """
+    Decorator memoizing ITool.execute for tools whose run only depends on their args, the given env
+    vars and input paths. inputs and outputs are callables returning the paths read and written for
+    some args, the tool's own source file always counts as an input. Successful runs are restored
+    from the ResultCache instead of executed, running with --clean or PSPYLIB_NO_CACHE skips the cache
+    e.g.   @cache_tool_result(inputs=lambda args: [args.source], outputs=lambda args: [args.output])
+           def execute(self, args, tmpdir):
+    """
+
+    def dec(execute):
+        def _dec(self, args, tmpdir):
+            if getattr(args, 'clean', False) or has_env_var_flag(RESULT_CACHE_DISABLE_ENV):
+                return execute(self, args, tmpdir)
+
+            result_cache = cache or ResultCache()
+            cls = type(self)
+            tool_inputs = [sys.modules[cls.__module__].__file__] + list(inputs(args) if inputs else [])
+            env = dict((var, get_env_var(var)) for var in env_vars)
+            key = result_cache.make_key('{}.{}'.format(cls.__module__, cls.__name__), vars(args), env, tool_inputs,
+                                        hash_inputs)
+            result = result_cache.get(key)
+            if result is not None:
+                log_info("Using cached result of tool {}", cls.__name__)
+                return result['rc']
+
+            rc = execute(self, args, tmpdir)
+            if not rc:
+                result_cache.put(key, {'rc': rc}, outputs(args) if outputs else ())
+            return rc
+
+        return _dec
+
+    return dec
+
+
+# ----------------------------------------------------------------------------------------
+# Pipelines
+# ----------------------------------------------------------------------------------------
+
+PIPELINE_STEP_OK = 'ok'
+PIPELINE_STEP_FAILED = 'failed'
+PIPELINE_STEP_SKIPPED = 'skipped'
+
+
+def _validate_pipeline(steps):
+    names = [step['name'] for step in steps]
+    if len(set(names)) != len(names):
+        raise ValueError("Pipeline step names must be unique: {}".format(names))
+    for step in steps:
+        for dependency in step.get('depends', []):
+            if dependency not in names:
+                raise ValueError("Step '{}' depends on unknown step '{}'".format(step['name'], dependency))
+    # Kahn's algorithm, whatever can't be sorted is part of a cycle
+    remaining = dict((step['name'], set(step.get('depends', []))) for step in steps)
+    while remaining:
+        ready = [name for name, dependencies in remaining.items() if not dependencies]
+        if not ready:
+            raise ValueError("Pipeline has a dependency cycle between {}".format(sorted(remaining)))
+        for name in ready:
+            del remaining[name]
+        for dependencies in remaining.values():
+            dependencies.difference_update(ready)
+
+
+def _run_pipeline_step(step, args, tmpdir):
+    try:
+        return execute_tool(step['tool'], args, tmpdir)
+    except SystemExit as e:
+        return e.code
+    except Exception as e:
+        log_error("Step '{}' raised: {}", step['name'], e)
+        return EXIT_CODE_FAILED
+
+
+def _pipeline_step_result(rc, start):
+    return {'rc': rc, 'status': PIPELINE_STEP_FAILED if rc else PIPELINE_STEP_OK, 'start': start, 'end': time.time()}
+
+
+def _fork_pipeline_step(step, args, tmpdir, running):
+    """
+    Runs a step in a forked process so it gets its own copy of the tool instances, working directory
+    and environment. Its stdout and stderr go to a pipe, returns {'pid', 'fd', 'start', 'output'}
+    """
+    read_fd, write_fd = os.pipe()
+    sys.stdout.flush()
+    sys.stderr.flush()
+    start = time.time()
+    pid = os.fork()
+    if pid == 0:
+        rc = EXIT_CODE_FAILED
+        try:
+            # Only the parent reads the output of the other steps
+            for fd in [read_fd] + [process['fd'] for process in running.values()]:
+                os.close(fd)
+            os.dup2(write_fd, 1)
+            os.dup2(write_fd, 2)
+            os.close(write_fd)
+            for stream in (sys.stdout, sys.stderr):
+                stream.reconfigure(line_buffering=True)
+            rc = _run_pipeline_step(step, args, tmpdir)
+            if rc is None:
+                rc = EXIT_CODE_SUCCESS
+            elif not isinstance(rc, int):
+                sys.stderr.write('{}\n'.format(rc))
+                rc = EXIT_CODE_FAILED
+        except BaseException:
+            traceback.print_exc()
+        finally:
+            sys.stdout.flush()
+            sys.stderr.flush()
+            os._exit(rc if 0 <= rc < 256 else EXIT_CODE_FAILED)
+    os.close(write_fd)
+    return {'pid': pid, 'fd': read_fd, 'start': start, 'output': b''}
+
+
+def _log_step_output(name, data):
+    for line in data.split(b'\n'):
+        print_safe('[{}] {}'.format(name, line.decode('utf8', errors='replace').rstrip('\r')))
 
-    if argv is None:
-        argv = sys.argv
 
+def _read_step_output(name, process):
+    """
+    Logs the complete lines the step wrote, prefixed with its name. Returns its exit code once the
+    step is done and None while it is still running
+    """
+    data = os.read(process['fd'], 65536)
+    if data:
+        lines, _, process['output'] = (process['output'] + data).rpartition(b'\n')
+        if lines:
+            _log_step_output(name, lines)
+        return None
+    if process['output']:
+        _log_step_output(name, process['output'])
+    _, status = os.waitpid(process['pid'], 0)
+    return os.WEXITSTATUS(status) if os.WIFEXITED(status) else EXIT_CODE_FAILED
+
+
+def get_critical_path(steps, results):
+    """
+    Chain of steps, ending at the one that finished last, where each step was waiting on the
+    dependency that finished last
+    """
+    depends = dict((step['name'], step.get('depends', [])) for step in steps)
+    executed = [name for name in results if results[name]['status'] != PIPELINE_STEP_SKIPPED]
+    path = []
+    name = max(executed, key=lambda n: results[n]['end']) if executed else None
+    while name is not None:
+        path.insert(0, name)
+        dependencies = [d for d in depends[name] if results[d]['status'] != PIPELINE_STEP_SKIPPED]
+        name = max(dependencies, key=lambda n: results[n]['end']) if dependencies else None
+    return path
+
+
+def execute_pipeline(steps, tmpdir, parser=None, workers=None, base_argv=None):
+    """
+    Runs a DAG of tool invocations. Each step is a dict with a unique 'name', the 'tool' to run,
+    its 'args' as a command line list and the names of the steps it 'depends' on. Up to workers
+    (the cpu count by default) steps whose dependencies are done run at the same time, each in its
+    own forked process with its output prefixed by the step name. Steps only share tmpdir. Steps
+    depending on a failed step are skipped. Without fork support steps run one at a time in process.
+    Returns a dict of name: {'rc', 'status', 'start', 'end'}
+    e.g.   execute_pipeline([{'name': 'fetch', 'tool': 'repos', 'args': ['--pull']},
+                             {'name': 'build', 'tool': 'build', 'depends': ['fetch']}], tmpdir)
+    """
+    import selectors
+
+    parser = parser or tool_parser
+    workers = workers or os.cpu_count() or 1
+    fork = hasattr(os, 'fork')
+    _validate_pipeline(steps)
+
+    # Parse everything upfront so a typo fails the pipeline before anything runs
+    step_args = {}
+    for step in steps:
+        try:
+            step_args[step['name']] = parser.parse_args((base_argv or []) + [step['tool']] + step.get('args', []))
+        except SystemExit:
+            raise ValueError("Invalid arguments for step '{}': {}".format(step['name'], step.get('args', [])))
+
+    def finish(name, result):
+        results[name] = result
+        log_info("Step '{}' {} in {:.2f}s", name, result['status'], result['end'] - result['start'])
+
+    results = {}
+    pending = dict((step['name'], step) for step in steps)
+    running = {}
+    selector = selectors.DefaultSelector()
+    try:
+        while pending or running:
+            scheduled = True
+            while scheduled:
+                scheduled = False
+                for name, step in list(pending.items()):
+                    dependencies = step.get('depends', [])
+                    if any(d in results and results[d]['status'] != PIPELINE_STEP_OK for d in dependencies):
+                        now = time.time()
+                        results[name] = {'rc': None, 'status': PIPELINE_STEP_SKIPPED, 'start': now, 'end': now}
+                        log_warn("Skipping step '{}', a dependency didn't succeed", name)
+                    elif all(d in results for d in dependencies) and len(running) < workers:
+                        log_info("Starting step '{}'", name)
+                        if fork:
+                            running[name] = _fork_pipeline_step(step, step_args[name], tmpdir, running)
+                            selector.register(running[name]['fd'], selectors.EVENT_READ, name)
+                        else:
+                            start = time.time()
+                            finish(name, _pipeline_step_result(_run_pipeline_step(step, step_args[name], tmpdir),
+                                                               start))
+                    else:
+                        continue
+                    del pending[name]
+                    scheduled = True
+            if not running:
+                break
+            for key, _ in selector.select():
+                name = key.data
+                rc = _read_step_output(name, running[name])
+                if rc is not None:
+                    selector.unregister(key.fd)
+                    os.close(key.fd)
+                    finish(name, _pipeline_step_result(rc, running.pop(name)['start']))
+    finally:
+        for process in running.values():
+            os.kill(process['pid'], signal.SIGTERM)
+            os.waitpid(process['pid'], 0)
+            os.close(process['fd'])
+        selector.close()
+    return results
+
+
+def log_pipeline_report(steps, results):
+    if not results:
+        return
+    origin = min(result['start'] for result in results.values())
+    log_info("{:<24}{:>10}{:>10}{:>10}", 'step', 'status', 'start', 'time')
+    for step in steps:
+        result = results[step['name']]
+        log_info("{:<24}{:>10}{:>10.2f}{:>10.2f}", step['name'], result['status'], result['start'] - origin,
+                 result['end'] - result['start'])
+    path = get_critical_path(steps, results)
+    log_info("Critical path: {} ({:.2f}s)", ' -> '.join(path),
+             sum(results[name]['end'] - results[name]['start'] for name in path))
+
+
+class PipelineTool(ITool):
+    """
+    Built-in tool running a pipeline json file: {"steps": [{"name", "tool", "args", "depends"}]}
+    The --clean, --dryrun and --force flags given to the pipeline are passed to every step
+    """
+
+    def __init__(self, parser, tmpdir):
+        parser.add_argument('pipeline', action=readable_file, help='Pipeline json file')
+        parser.add_argument('--workers', type=int, default=None,
+                            help='Max steps running at the same time, defaults to the cpu count')
+
+    def execute(self, args, tmpdir):
+        pipeline = load_json(args.pipeline)
+        base_argv = ['--{}'.format(flag) for flag in ['clean', 'dryrun', 'force'] if getattr(args, flag, False)]
+        try:
+            results = execute_pipeline(pipeline['steps'], tmpdir, workers=args.workers, base_argv=base_argv)
+        except (ValueError, KeyError, TypeError) as e:
+            die("Invalid pipeline '{}': {}", args.pipeline, e)
+        log_pipeline_report(pipeline['steps'], results)
+        failed = [name for name, result in results.items() if result['status'] != PIPELINE_STEP_OK]
+        return EXIT_CODE_FAILED if failed else EXIT_CODE_SUCCESS
+
+
+def _create_parser(description, version, copyright, author):
     parser = argparse.ArgumentParser(add_help=True, argument_default=argparse.SUPPRESS,
                                      description=description.format(version=version, copyright=copyright,
                                                                     author=author))
@@ -105,36 +384,370 @@ def main_tool(root, argv=None, description=__description__, version=__version__,
                         help='Running the CLI in interactive mode', required=False)
     parser.add_argument('--gui', action='store_true', default=False,
                         help='Run the tool with a nice and simple UI', required=False)
+    return parser
+
+
+def _init_parser_tools(root, parser, tmpdir):
+    global tool_parser
+    tool_parser = parser
+    # Add first parser in the nested tree
+    subparser = parser.add_subparsers(dest='tool', help='Available tools')
+    subparser.required = True
+    init_tools(root, subparser, tmpdir)
+
+
+def main_tool(root, argv=None, description=__description__, version=__version__, copyright=__copyright__, author=__author__, origin=None, server=None):
+    """
+    Runs the tool selected by argv. With server=True (or the PSTOOL_SERVER env flag when server is None)
+    the tool is executed by a warm tool server, see execute_on_tool_server
+    """
+    global tool_origin
+    tool_origin = origin
+
+    if argv is None:
+        argv = sys.argv
+
+    create_parser = lambda: _create_parser(description, version, copyright, author)
+
+    if server is None:
+        server = has_env_var_flag(TOOL_SERVER_ENV)
+    if server and '--interactive' not in argv and '--gui' not in argv and not has_env_var('_ARGCOMPLETE'):
+        handled, rc = execute_on_tool_server(root, argv, create_parser)
+        if handled:
+            return rc
+
+    parser = create_parser()
 
     # Generate a temporal directory for the whole thing
-    with tempfile.TemporaryDirectory() as tmpdir:
-        try:
-            # Add first parser in the nested tree
-            subparser = parser.add_subparsers(dest='tool', help='Available tools')
-            subparser.required = True
-            init_tools(root, subparser, tmpdir)
+    tmpdir = create_scratch_space()
+    try:
+        _init_parser_tools(root, parser, tmpdir)
+        # argcomplete only has work to do when the shell is asking for completions
+        if has_env_var('_ARGCOMPLETE'):
             argcomplete.autocomplete(parser)
 
-            if '--interactive' in argv:
-                log_info("Welcome to the interactive console. Type 'q', 'quit' or 'exit' to exit the console.")
-                while True:
+        if '--interactive' in argv:
+            log_info("Welcome to the interactive console. Type 'q', 'quit' or 'exit' to exit the console.")
+            while True:
+
+                command = input_str('$').lower()
+                if command == 'q' or command == 'quit' or command == 'exit':
+                    break
+
+                try:
+                    args = parser.parse_args(command.split())
+                    execute_tool(args.tool, args, tmpdir)
+                except SystemExit:
+                    continue
+
+            return EXIT_CODE_SUCCESS
+        elif '--gui' in argv:
+            log_error("Not yet pal implemented")
+        else:
+            args = parser.parse_args(argv)
+            return execute_tool(args.tool, args, tmpdir)
+    finally:
+        # Deleting big intermediates can take a while, don't make the caller wait for it
+        tmpdir.cleanup()
+
+
+# ----------------------------------------------------------------------------------------
+# Tool server
+# ----------------------------------------------------------------------------------------
+
+TOOL_SERVER_ENV = 'PSTOOL_SERVER'
+TOOL_SERVER_IDLE_TIMEOUT_ENV = 'PSTOOL_SERVER_IDLE_TIMEOUT'
+TOOL_SERVER_IDLE_TIMEOUT = 900
+TOOL_SERVER_START_TIMEOUT = 60
+
+_STALE_SERVER = object()
+
+
+def tool_server_supported():
+    return hasattr(socket, 'AF_UNIX') and hasattr(socket, 'SCM_RIGHTS') and hasattr(socket, 'SO_PEERCRED') and \
+        hasattr(os, 'fork')
+
+
+def _get_tool_server_dir():
+    """
+    Private directory holding the server sockets of the current user: $XDG_RUNTIME_DIR/pstool or
+    <tmp>/pstool-<uid>. Returns None when it exists but isn't a 0700 directory owned by us, anyone
+    able to place a socket there would receive the environment and std streams of every call
+    """
+    runtime_dir = get_env_var('XDG_RUNTIME_DIR')
+    if runtime_dir and os.path.isdir(runtime_dir):
+        path = os.path.join(runtime_dir, 'pstool')
+    else:
+        path = os.path.join(tempfile.gettempdir(), 'pstool-{}'.format(os.getuid()))
+    try:
+        os.mkdir(path, 0o700)
+    except FileExistsError:
+        pass
+    except OSError:
+        return None
+    st = os.lstat(path)
+    if not stat.S_ISDIR(st.st_mode) or st.st_uid != os.getuid() or st.st_mode & 0o077:
+        log_warn("Tool server dir {} is not a private directory of the current user, ignoring it", path)
+        return None
+    return path
+
+
+def get_tool_server_address(root):
+    server_dir = _get_tool_server_dir()
+    if server_dir is None:
+        return None
+    key = '{}:{}'.format(os.path.abspath(root), sys.executable)
+    return os.path.join(server_dir, '{}.sock'.format(hashlib.sha1(key.encode('utf8')).hexdigest()[:16]))
+
+
+def _is_same_user(conn):
+    """ Whether the process at the other end of a unix socket runs as the current user
+    """
+    creds = conn.getsockopt(socket.SOL_SOCKET, socket.SO_PEERCRED, struct.calcsize('3i'))
+    _, uid, _ = struct.unpack('3i', creds)
+    return uid == os.getuid()
+
+
+def _tools_fingerprint(root):
+    stamps = []
+    for path in [root, os.path.dirname(os.path.abspath(__file__))]:
+        for _, _, files in walk_dir(path, exclude=['__pycache__', '.git']):
+            for entry in files:
+                if entry.name.endswith('.py'):
+                    st = entry.stat()
+                    stamps.append((entry.path, st.st_mtime_ns, st.st_size))
+    return sorted(stamps)
 
-                    command = input_str('$').lower()
-                    if command == 'q' or command == 'quit' or command == 'exit':
-                        break
 
+def _send_message(conn, message):
+    conn.sendall(json.dumps(message).encode('utf8') + b'\n')
+
+
+def _std_fds():
+    fds = []
+    for fd in (0, 1, 2):
+        try:
+            os.fstat(fd)
+        except OSError:
+            fd = os.open(os.devnull, os.O_RDWR)
+        fds.append(fd)
+    return fds
+
+
+def _connect_tool_server(address, timeout=0):
+    deadline = time.time() + timeout
+    while True:
+        client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            client.connect(address)
+            if _is_same_user(client):
+                return client
+            log_warn("Tool server at {} runs as another user, not using it", address)
+            client.close()
+            return None
+        except OSError:
+            client.close()
+        if time.time() >= deadline:
+            return None
+        time.sleep(0.05)
+
+
+def _forward_to_tool_server(client, argv):
+    request = {'argv': argv, 'cwd': os.getcwd(), 'env': dict(os.environ)}
+    sys.stdout.flush()
+    sys.stderr.flush()
+    # Our stdin, stdout and stderr are handed over so the tool writes straight to them
+    client.sendmsg([b'\0'], [(socket.SOL_SOCKET, socket.SCM_RIGHTS, array.array('i', _std_fds()))])
+    _send_message(client, request)
+    pid = None
+    with client.makefile('rb') as responses:
+        try:
+            for line in responses:
+                response = json.loads(line.decode('utf8'))
+                if 'pid' in response:
+                    pid = response['pid']
+                elif 'rc' in response:
+                    return response['rc']
+                elif 'stale' in response:
+                    return _STALE_SERVER
+        except KeyboardInterrupt as e:
+            if pid:
+                os.kill(pid, signal.SIGINT)
+            raise e
+    # A server that closes the connection before running anything is shutting down
+    return _STALE_SERVER if pid is None else EXIT_CODE_FAILED
+
+
+def execute_on_tool_server(root, argv, create_parser):
+    """
+    Forwards argv, cwd and env to the tool server of root, spawning it when needed, and returns
+    (handled, exit code). The server keeps the tools imported and instanced and forks for every
+    request, so each run gets a pristine copy of the warm process. It restarts when any tool or
+    pspylib source changes and exits after PSTOOL_SERVER_IDLE_TIMEOUT seconds without requests.
+    When the server can't be used (handled, exit code) is (False, None) and the tool should run in process
+    """
+    if not tool_server_supported():
+        return False, None
+    address = get_tool_server_address(root)
+    if address is None:
+        return False, None
+    for _ in range(3):
+        client = _connect_tool_server(address)
+        if client is None:
+            _spawn_tool_server(root, address, create_parser)
+            client = _connect_tool_server(address, TOOL_SERVER_START_TIMEOUT)
+        if client is None:
+            break
+        with client:
+            rc = _forward_to_tool_server(client, argv)
+        if rc is not _STALE_SERVER:
+            return True, rc
+    log_warn("Tool server at {} not available, running in process", address)
+    return False, None
+
+
+def _spawn_tool_server(root, address, create_parser):
+    pid = os.fork()
+    if pid != 0:
+        # The intermediate child exits as soon as the server is forked
+        os.waitpid(pid, 0)
+        return
+    try:
+        os.setsid()
+        if os.fork() == 0:
+            log_fd = os.open(address + '.log', os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            devnull = os.open(os.devnull, os.O_RDONLY)
+            os.dup2(devnull, 0)
+            os.dup2(log_fd, 1)
+            os.dup2(log_fd, 2)
+            serve_tools(root, address, create_parser)
+    except Exception:
+        traceback.print_exc()
+    finally:
+        os._exit(EXIT_CODE_SUCCESS)
+
+
+def _receive_request(conn):
+    fds = array.array('i')
+    _, ancdata, _, _ = conn.recvmsg(1, socket.CMSG_SPACE(3 * fds.itemsize))
+    for level, kind, data in ancdata:
+        if level == socket.SOL_SOCKET and kind == socket.SCM_RIGHTS:
+            fds.frombytes(data[:len(data) - (len(data) % fds.itemsize)])
+    with conn.makefile('rb') as f:
+        request = json.loads(f.readline().decode('utf8'))
+    return list(fds), request
+
+
+def serve_tools(root, address, create_parser):
+    """
+    Runs the tool server of root until it goes idle or its sources change, only one server per
+    address is alive at a time
+    """
+    import fcntl
+    lock_fd = os.open(address + '.lock', os.O_WRONLY | os.O_CREAT, 0o600)
+    fcntl.flock(lock_fd, fcntl.LOCK_EX)
+    # Someone else could have started a server while we were waiting for the lock
+    client = _connect_tool_server(address)
+    if client is not None:
+        client.close()
+        return
+
+    fingerprint = _tools_fingerprint(root)
+    idle_timeout = get_config(os.environ, TOOL_SERVER_IDLE_TIMEOUT_ENV, float, TOOL_SERVER_IDLE_TIMEOUT)
+    tmpdir = create_scratch_space()
+    try:
+        parser = create_parser()
+        _init_parser_tools(root, parser, tmpdir)
+        sys.stdout.flush()
+        sys.stderr.flush()
+
+        if os.path.exists(address):
+            os.remove(address)
+        server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        umask = os.umask(0o077)
+        try:
+            server.bind(address)
+        finally:
+            os.umask(umask)
+        server.listen(64)
+        server.settimeout(idle_timeout)
+        # Request processes are never waited for
+        signal.signal(signal.SIGCHLD, signal.SIG_IGN)
+        # Being terminated must still remove the socket and the scratch space
+        signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(EXIT_CODE_SUCCESS))
+        log_info("Tool server for {} listening at {}", root, address)
+        try:
+            while True:
+                try:
+                    conn, _ = server.accept()
+                except socket.timeout:
+                    log_info("Tool server idle for {} seconds, exiting", idle_timeout)
+                    break
+                with conn:
+                    if not _is_same_user(conn):
+                        log_error("Discarding request from another user")
+                        continue
+                    conn.settimeout(10)
                     try:
-                        args = parser.parse_args(command.split())
-                        execute_tool(args.tool, args, tmpdir)
-                    except SystemExit:
+                        fds, request = _receive_request(conn)
+                    except (OSError, ValueError) as e:
+                        log_error("Discarding malformed request: {}", e)
                         continue
+                    if _tools_fingerprint(root) != fingerprint:
+                        log_info("Tool sources changed, exiting")
+                        _send_message(conn, {'stale': True})
+                        break
+                    if os.fork() == 0:
+                        server.close()
+                        _handle_tool_request(conn, fds, request, parser, tmpdir)
+                    for fd in fds:
+                        os.close(fd)
+        finally:
+            server.close()
+            os.remove(address)
+    finally:
+        tmpdir.cleanup()
+    os.close(lock_fd)
+
 
-                return EXIT_CODE_SUCCESS
-            elif '--gui' in argv:
-                log_error("Not yet pal implemented")
+def _handle_tool_request(conn, fds, request, parser, tmpdir):
+    rc = EXIT_CODE_FAILED
+    try:
+        signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        conn.settimeout(None)
+        for target, fd in enumerate(fds):
+            os.dup2(fd, target)
+            os.close(fd)
+        os.chdir(request['cwd'])
+        os.environ.clear()
+        os.environ.update(request['env'])
+        for stream in (sys.__stdout__, sys.__stderr__):
+            stream.reconfigure(line_buffering=True)
+        if 'colorama' in sys.modules:
+            # Let colorama decide again on stripping colors for the client's streams
+            import colorama
+            colorama.deinit()
+            colorama.init()
+        _send_message(conn, {'pid': os.getpid()})
+
+        request_tmpdir = create_scratch_space()
+        try:
+            args = parser.parse_args(request['argv'])
+            rc = execute_tool(args.tool, args, request_tmpdir)
+        except SystemExit as e:
+            if e.code is None or isinstance(e.code, int):
+                rc = e.code
             else:
-                args = parser.parse_args(argv)
-                return execute_tool(args.tool, args, tmpdir)
+                sys.stderr.write('{}\n'.format(e.code))
+        except BaseException:
+            traceback.print_exc()
         finally:
-            for int_dir in list_dirs(tmpdir):
-                purge_dir(int_dir)
+            request_tmpdir.cleanup()
+            sys.stdout.flush()
+            sys.stderr.flush()
+        _send_message(conn, {'rc': rc})
+    except BaseException:
+        traceback.print_exc()
+    finally:
+        os._exit(EXIT_CODE_SUCCESS)
@@ -25,5 +25,6 @@ setup(
         "psutil",
         "gitpython",
         "colorama",
+        "importlib_metadata; python_version < '3.8'",
     ],
 )